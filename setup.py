@@ -30,5 +30,8 @@ setup(
         "requests>=2.20.0",
         "ipython>=7.0.0",
     ],
+    extras_require={
+        "fast": ["orjson"],
+    },
     keywords="slack notifications jupyter notebook monitoring",
 )
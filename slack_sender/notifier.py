@@ -1,16 +1,110 @@
 from typing import List
 import datetime
-import traceback
-import json
 import socket
-import requests
-from IPython.core.magic import register_cell_magic
-from IPython.display import display, HTML
-from IPython import get_ipython
-from io import StringIO
+import queue
+import threading
+import atexit
+import time
+from urllib.parse import urlparse
 import sys
 
-DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+import json
+
+try:
+    import orjson
+    
+    def _dumps(obj) -> bytes:
+        try:
+            return orjson.dumps(obj)
+        except orjson.JSONEncodeError:
+            # orjson rejects lone surrogates, which json escapes
+            return json.dumps(obj).encode()
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+# Slack incoming webhooks allow about one message per second
+RATE_LIMIT_INTERVAL = 1.0
+RATE_LIMIT_BURST = 3
+# Longest Retry-After in seconds honoured before retrying a rate-limited post
+MAX_RETRY_AFTER = 5.0
+# (connect, read) timeout in seconds for webhook posts
+REQUEST_TIMEOUT = (2, 5)
+JSON_HEADERS = {"Content-Type": "application/json"}
+# Notifications queued within this many seconds are sent as one message
+BATCH_WINDOW = 0.5
+# Limits on a combined message; Slack truncates text beyond about 4000 characters
+MAX_BATCH_SIZE = 10
+MAX_BATCH_TEXT = 4000
+BATCH_SEPARATOR = "\n---\n"
+# Upper bound in seconds on sending pending notifications at shutdown
+SHUTDOWN_TIMEOUT = 5.0
+
+# Queued to tell a notifier's worker thread to exit
+_STOP = object()
+
+# Notifiers whose worker is still running, drained once at interpreter exit.
+# A running worker thread holds its notifier anyway, so a plain set is enough.
+_open_notifiers = set()
+
+# The notifier currently bound to the %%notify_slack magic
+_magic_notifier = None
+
+
+def _close_all():
+    """Close every open notifier, sharing a single shutdown deadline"""
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    for notifier in list(_open_notifiers):
+        notifier.close(timeout=max(0.0, deadline - time.monotonic()))
+
+
+atexit.register(_close_all)
+
+
+def _warn(message: str):
+    """Report a background failure without writing into a monitored cell's output"""
+    # sys.stdout may be a cell's _TeeCapture while the worker runs
+    if sys.__stderr__ is not None:
+        print(f"Warning: {message}", file=sys.__stderr__)
+
+
+class _TeeCapture:
+    """Forward writes to the real stream while keeping a bounded copy for Slack"""
+    
+    def __init__(self, real, cap: int = 2000):
+        self.real = real
+        self.chunks = []
+        self.size = 0
+        self.cap = cap
+        self.truncated = False
+    
+    def write(self, s):
+        self.real.write(s)
+        # Never store more than `cap` characters, however large a single write is
+        remaining = self.cap - self.size
+        if remaining > 0:
+            chunk = s[:remaining]
+            self.chunks.append(chunk)
+            self.size += len(chunk)
+            if len(s) > remaining:
+                self.truncated = True
+        elif s:
+            self.truncated = True
+        return len(s)
+    
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+    
+    def flush(self):
+        self.real.flush()
+    
+    def getvalue(self) -> str:
+        output = ''.join(self.chunks)
+        return output + "..." if self.truncated else output
+    
+    def __getattr__(self, name):
+        return getattr(self.real, name)
 
 class JupyterSlackNotifier:
     """
@@ -30,9 +124,8 @@ class JupyterSlackNotifier:
         result = train_model()
     """
     
-    _instance = None
-    
-    def __init__(self, webhook_url: str, channel: str, user_mentions: List[str] = []):
+    def __init__(self, webhook_url: str, channel: str, user_mentions: List[str] = [],
+                 min_duration_for_start: float = 2.0):
         """
         Initialize the Slack notifier for Jupyter notebooks.
         
@@ -46,21 +139,174 @@ class JupyterSlackNotifier:
         user_mentions : List[str], optional
             Optional users ids to notify.
             Visit https://api.slack.com/methods/users.identity for more details.
+        min_duration_for_start : float, optional
+            Seconds a cell must run before the start notification is sent.
+            Cells finishing sooner only send the completion notification.
         """
         self.webhook_url = webhook_url
         self.channel = channel
         self.user_mentions = user_mentions
+        self._mentions_suffix = '\n' + ' '.join(user_mentions) if user_mentions else ''
+        
+        # Static fields of each notification payload
+        self._start_tmpl = {"username": "Knock Knock", "channel": channel, "icon_emoji": ":clapper:"}
+        self._success_tmpl = {"username": "Knock Knock", "channel": channel, "icon_emoji": ":tada:"}
+        self._error_tmpl = {"username": "Knock Knock", "channel": channel, "icon_emoji": ":skull_and_crossbones:"}
+        self.min_duration_for_start = min_duration_for_start
         self.host_name = socket.gethostname()
         
-        # Set as the active instance for the magic command
-        JupyterSlackNotifier._instance = self
+        # Imported here so that importing the package stays cheap
+        import requests
+        from requests.adapters import HTTPAdapter
         
-        # Register the cell magic
+        # Reuse one connection to Slack instead of a new TLS handshake per post
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        
+        # Notifications are posted from a background thread so the cell
+        # does not wait on the network round-trip to Slack
+        self._queue = queue.Queue()
+        self._closed = False
+        self._worker = threading.Thread(target=self._post_worker, daemon=True)
+        self._worker.start()
+        _open_notifiers.add(self)
+        
+        # Register the cell magic, bound to this instance
         self._register_magic()
         
     
+    def close(self, timeout: float = SHUTDOWN_TIMEOUT):
+        """
+        Send pending notifications and stop the background worker.
+        
+        Parameters:
+        -----------
+        timeout : float, optional
+            Seconds to wait for pending notifications; any still queued
+            afterwards are dropped.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        _open_notifiers.discard(self)
+        self._queue.put(_STOP)
+        self._worker.join(timeout)
+    
+    def _post_worker(self):
+        """Post queued notifications to Slack, batching those that arrive together"""
+        # Resolved here rather than in __init__ so a stalled resolver cannot
+        # hang the notebook cell that creates the notifier
+        host_resolved = self._resolve_webhook_host()
+        # Token bucket: up to RATE_LIMIT_BURST posts at once, then one per interval
+        next_allowed = time.monotonic()
+        # Payload rate limited by Slack, posted again once before anything newer
+        retry = None
+        # Payload taken from the queue that did not fit in the previous batch
+        held = None
+        stopping = False
+        while True:
+            batch = []
+            if retry is not None:
+                dump, retry, retried = retry, None, True
+            else:
+                if held is not None:
+                    first, held = held, None
+                elif stopping:
+                    break
+                else:
+                    first = self._queue.get()
+                    if first is _STOP:
+                        self._queue.task_done()
+                        break
+                
+                # Only merge payloads built from the same template, and keep
+                # the combined message within Slack's limits
+                batch = [first]
+                text_length = len(first["text"])
+                deadline = time.monotonic() + BATCH_WINDOW
+                while not stopping and len(batch) < MAX_BATCH_SIZE:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        dump = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if dump is _STOP:
+                        self._queue.task_done()
+                        stopping = True
+                        break
+                    text_length += len(BATCH_SEPARATOR) + len(dump["text"])
+                    if dump["icon_emoji"] != first["icon_emoji"] or text_length > MAX_BATCH_TEXT:
+                        held = dump
+                        break
+                    batch.append(dump)
+                
+                if len(batch) == 1:
+                    dump = first
+                else:
+                    dump = {**first, "text": BATCH_SEPARATOR.join(p["text"] for p in batch)}
+                retried = False
+            
+            try:
+                # Skip posting while the webhook host does not resolve
+                if not host_resolved:
+                    host_resolved = self._resolve_webhook_host()
+                    if not host_resolved:
+                        _warn(f"Failed to send notification: cannot resolve {urlparse(self.webhook_url).hostname}")
+                        continue
+                
+                body = _dumps(dump)
+                now = time.monotonic()
+                delay = next_allowed - now - (RATE_LIMIT_BURST - 1) * RATE_LIMIT_INTERVAL
+                if delay > 0:
+                    time.sleep(delay)
+                next_allowed = max(next_allowed, now) + RATE_LIMIT_INTERVAL
+                
+                response = self._session.post(self.webhook_url, data=body, headers=JSON_HEADERS, timeout=REQUEST_TIMEOUT)
+                if response.status_code == 429 and not retried:
+                    # Rate limited: hold off for Retry-After (bounded) and post
+                    # this payload again once, rather than sleeping here
+                    try:
+                        retry_after = float(response.headers.get("Retry-After", RATE_LIMIT_INTERVAL))
+                    except ValueError:
+                        retry_after = RATE_LIMIT_INTERVAL
+                    retry_after = min(max(retry_after, 0.0), MAX_RETRY_AFTER)
+                    next_allowed = time.monotonic() + retry_after + (RATE_LIMIT_BURST - 1) * RATE_LIMIT_INTERVAL
+                    retry = dump
+                elif not response.ok:
+                    _warn(f"Failed to send notification: HTTP {response.status_code}")
+            except Exception as e:
+                _warn(f"Failed to send notification: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        
+        self._session.close()
+    
+    def _enqueue(self, dump: dict):
+        """Hand a payload to the worker, unless this notifier was closed"""
+        if self._closed:
+            print("Warning: Notification not sent: this JupyterSlackNotifier was closed "
+                  "or replaced by a newer one", file=sys.stderr)
+            return
+        self._queue.put(dump)
+    
+    def _resolve_webhook_host(self) -> bool:
+        """Resolve the webhook host so later posts hit the resolver cache"""
+        try:
+            socket.getaddrinfo(urlparse(self.webhook_url).hostname, 443)
+        except (socket.gaierror, UnicodeError):
+            return False
+        return True
+    
     def _register_magic(self):
         """Register the cell magic command"""
+        from IPython.core.magic import register_cell_magic
+        from IPython import get_ipython
+        
+        notifier = self
+        
         @register_cell_magic
         def notify_slack(line, cell):
             """
@@ -70,88 +316,91 @@ class JupyterSlackNotifier:
                 %%notify_slack
                 # Your code here
             """
-            if JupyterSlackNotifier._instance is None:
-                display(HTML('<span style="color: red;">Error: JupyterSlackNotifier not initialized!</span>'))
-                return
-            
-            notifier = JupyterSlackNotifier._instance
+            # Wall-clock time is only used for display; durations use the monotonic clock
             start_time = datetime.datetime.now()
+            start_monotonic = time.monotonic()
             
-            # Send start notification with the cell code
-            notifier._send_start_notification(cell, start_time)
+            # Send start notification with the cell code, unless the cell
+            # finishes before the delay expires
+            start_lock = threading.Lock()
+            cell_finished = threading.Event()
+            
+            def send_start():
+                # Timer.cancel() cannot stop a callback that already started,
+                # so the completion path sets cell_finished under the same lock
+                with start_lock:
+                    if not cell_finished.is_set():
+                        notifier._send_start_notification(cell, start_time)
+            
+            start_timer = threading.Timer(notifier.min_duration_for_start, send_start)
+            start_timer.daemon = True
+            start_timer.start()
             
             # Get the IPython instance to access the user namespace
             ipython = get_ipython()
             
-            # Capture stdout
+            # Capture stdout while still showing it in the notebook
             old_stdout = sys.stdout
-            sys.stdout = captured_output = StringIO()
-            
-            cell_result = None
+            sys.stdout = captured_output = _TeeCapture(old_stdout)
             
             try:
                 # Execute the cell code in the user's namespace
                 result = ipython.run_cell(cell)
-                
-                # Get the output
-                output = captured_output.getvalue()
-                
-                # Get the result value if there is one
-                if result.result is not None:
-                    cell_result = result.result
-                
-                # Restore stdout
-                sys.stdout = old_stdout
-                
-                # Print the output so it still shows in the notebook
-                if output:
-                    print(output, end='')
-                
-                # Send success notification with output
-                end_time = datetime.datetime.now()
-                elapsed_time = end_time - start_time
-                notifier._send_success_notification(cell, start_time, end_time, elapsed_time, output, cell_result)
-                
             except Exception as ex:
-                # Restore stdout
-                sys.stdout = old_stdout
-                
                 # Get any output that was produced before the error
                 output = captured_output.getvalue()
-                if output:
-                    print(output, end='')
+                sys.stdout = old_stdout
                 
                 # Send error notification
-                end_time = datetime.datetime.now()
-                elapsed_time = end_time - start_time
+                with start_lock:
+                    cell_finished.set()
+                elapsed_time = datetime.timedelta(seconds=time.monotonic() - start_monotonic)
+                end_time = start_time + elapsed_time
                 notifier._send_error_notification(cell, start_time, end_time, elapsed_time, ex, output)
                 raise ex
+            finally:
+                # Restore stdout and stop the start notification even if the
+                # cell was interrupted by a BaseException
+                sys.stdout = old_stdout
+                with start_lock:
+                    cell_finished.set()
+                start_timer.cancel()
+            
+            # Get the output and the result value if there is one
+            output = captured_output.getvalue()
+            cell_result = result.result
+            
+            elapsed_time = datetime.timedelta(seconds=time.monotonic() - start_monotonic)
+            end_time = start_time + elapsed_time
+            
+            # run_cell reports exceptions on the result instead of raising them
+            error = result.error_before_exec or result.error_in_exec
+            if error is not None:
+                notifier._send_error_notification(cell, start_time, end_time, elapsed_time, error, output)
+            else:
+                # Send success notification with output
+                notifier._send_success_notification(cell, start_time, end_time, elapsed_time, output, cell_result)
+        
+        # The magic can only reach one notifier, so shut down the one it
+        # replaced, once registration has succeeded
+        global _magic_notifier
+        previous, _magic_notifier = _magic_notifier, self
+        if previous is not None and previous is not self:
+            previous.close()
     
     def _send_start_notification(self, cell_code: str, start_time: datetime.datetime):
         """Send notification when cell execution starts"""
         # Truncate cell code if too long
         code_preview = cell_code[:500] + "..." if len(cell_code) > 500 else cell_code
         
-        contents = [
-            'Cell is running.',
-            f'Starting date: {start_time.strftime(DATE_FORMAT)}',
+        text = (
+            'Cell is running.\n'
+            f'Starting date: {start_time.isoformat(sep=" ", timespec="seconds")}\n'
             f'\nCell Code:\n```python\n{code_preview}\n```'
-        ]
-        
-        if self.user_mentions:
-            contents.append(' '.join(self.user_mentions))
-        
-        dump = {
-            "username": "Knock Knock",
-            "channel": self.channel,
-            "icon_emoji": ":clapper:",
-            "text": '\n'.join(contents)
-        }
+            f'{self._mentions_suffix}'
+        )
         
-        try:
-            requests.post(self.webhook_url, json.dumps(dump))
-        except Exception as e:
-            print(f"Warning: Failed to send start notification: {e}")
+        self._enqueue({**self._start_tmpl, "text": text})
     
     def _send_success_notification(self, cell_code: str, start_time: datetime.datetime, 
                                    end_time: datetime.datetime, elapsed_time: datetime.timedelta,
@@ -160,82 +409,66 @@ class JupyterSlackNotifier:
         # Truncate cell code if too long
         code_preview = cell_code[:300] + "..." if len(cell_code) > 300 else cell_code
         
-        contents = [
-            "Cell is done running.",
-            f'Starting date: {start_time.strftime(DATE_FORMAT)}',
-            f'End date: {end_time.strftime(DATE_FORMAT)}',
-            f'Execution duration: {str(elapsed_time)}',
-            f'\nCell Code:\n```python\n{code_preview}\n```'
-        ]
-        
         # Add output if present (truncate if too long for Slack)
+        output_section = ''
         if output:
             output_preview = output[:2000] + "..." if len(output) > 2000 else output
-            contents.append(f'\nCell Output:\n```\n{output_preview}\n```')
+            output_section = f'\n\nCell Output:\n```\n{output_preview}\n```'
         
         # Add return value if present
+        result_section = ''
         if cell_result is not None:
             try:
                 result_str = str(cell_result)
                 if len(result_str) > 500:
                     result_str = result_str[:500] + "..."
-                contents.append(f'\nReturn Value: {result_str}')
+                result_section = f'\n\nReturn Value: {result_str}'
             except:
-                contents.append('\nReturn Value: <unable to stringify>')
-        
-        if self.user_mentions:
-            contents.append(' '.join(self.user_mentions))
+                result_section = '\n\nReturn Value: <unable to stringify>'
         
-        dump = {
-            "username": "Knock Knock",
-            "channel": self.channel,
-            "icon_emoji": ":tada:",
-            "text": '\n'.join(contents)
-        }
+        text = (
+            'Cell is done running.\n'
+            f'Starting date: {start_time.isoformat(sep=" ", timespec="seconds")}\n'
+            f'End date: {end_time.isoformat(sep=" ", timespec="seconds")}\n'
+            f'Execution duration: {elapsed_time}\n'
+            f'\nCell Code:\n```python\n{code_preview}\n```'
+            f'{output_section}{result_section}{self._mentions_suffix}'
+        )
         
-        try:
-            requests.post(self.webhook_url, json.dumps(dump))
-        except Exception as e:
-            print(f"Warning: Failed to send success notification: {e}")
+        self._enqueue({**self._success_tmpl, "text": text})
     
     def _send_error_notification(self, cell_code: str, start_time: datetime.datetime,
                                  end_time: datetime.datetime, elapsed_time: datetime.timedelta,
                                  exception: Exception, output: str = ""):
         """Send notification when cell execution crashes"""
+        import traceback
+        
         # Truncate cell code if too long
         code_preview = cell_code[:300] + "..." if len(cell_code) > 300 else cell_code
         
-        contents = [
-            "Cell crashed ☠️",
-            f'Starting date: {start_time.strftime(DATE_FORMAT)}',
-            f'Crash date: {end_time.strftime(DATE_FORMAT)}',
-            f'Crashed execution duration: {str(elapsed_time)}',
-            f'\nCell Code:\n```python\n{code_preview}\n```\n'
-        ]
-        
         # Add any output that was produced before the error
+        output_section = ''
         if output:
             output_preview = output[:1000] + "..." if len(output) > 1000 else output
-            contents.append(f'Output before error:\n```\n{output_preview}\n```\n')
-        
-        contents.extend([
-            "Here's the error:",
-            f'{exception}\n',
-            "Traceback:",
-            f'```\n{traceback.format_exc()}\n```'
-        ])
+            output_section = f'\nOutput before error:\n```\n{output_preview}\n```\n'
         
-        if self.user_mentions:
-            contents.append(' '.join(self.user_mentions))
+        # Bound the error text to Slack's limits before building the message
+        error_preview = str(exception)[-3000:]
+        traceback_preview = ''.join(traceback.format_exception(
+            type(exception), exception, exception.__traceback__, limit=-20))[-3000:]
         
-        dump = {
-            "username": "Knock Knock",
-            "channel": self.channel,
-            "icon_emoji": ":skull_and_crossbones:",
-            "text": '\n'.join(contents)
-        }
+        text = (
+            'Cell crashed ☠️\n'
+            f'Starting date: {start_time.isoformat(sep=" ", timespec="seconds")}\n'
+            f'Crash date: {end_time.isoformat(sep=" ", timespec="seconds")}\n'
+            f'Crashed execution duration: {elapsed_time}\n'
+            f'\nCell Code:\n```python\n{code_preview}\n```\n'
+            f'{output_section}'
+            "\nHere's the error:\n"
+            f'{error_preview}\n'
+            '\nTraceback:\n'
+            f'```\n{traceback_preview}\n```'
+            f'{self._mentions_suffix}'
+        )
         
-        try:
-            requests.post(self.webhook_url, json.dumps(dump))
-        except Exception as e:
-            print(f"Warning: Failed to send error notification: {e}")
+        self._enqueue({**self._error_tmpl, "text": text})